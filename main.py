@@ -1,87 +1,124 @@
-import psycopg2
-from psycopg2.extras import execute_values
-from prettytable import PrettyTable
-import json
-import random
+import psycopg
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+import statistics
 import time
 
 # ---------------------------
 # PostgreSQL connection setup
 # ---------------------------
-conn = psycopg2.connect(
-    host="localhost",
-    database="test"
-)
+def connect():
+    return psycopg.connect(
+        host="localhost",
+        dbname="test"
+    )
+
+conn = connect()
 cur = conn.cursor()
 
+# Every user profile is one of these four documents.
+PROFILE_JSONS = (
+    '{"prefs":{"theme":"dark","lang":"en"}}',
+    '{"prefs":{"theme":"dark","lang":"fr"}}',
+    '{"prefs":{"theme":"light","lang":"en"}}',
+    '{"prefs":{"theme":"light","lang":"fr"}}',
+)
+
 # ---------------------------
 # Helper functions
 # ---------------------------
 def recreate_tables():
     cur.execute("DROP TABLE IF EXISTS users, articles, documents;")
     conn.commit()
+    # Benchmark data is regenerated on every run, so skip WAL entirely.
     cur.execute("""
-    CREATE TABLE users (id serial PRIMARY KEY, name text, profile jsonb);
-    CREATE TABLE articles (id serial PRIMARY KEY, title text, tags text[]);
-    CREATE TABLE documents (id serial PRIMARY KEY, content text);
+    CREATE UNLOGGED TABLE users (id serial PRIMARY KEY, name text, profile jsonb);
+    CREATE UNLOGGED TABLE articles (id serial PRIMARY KEY, title text, tags text[]);
+    CREATE UNLOGGED TABLE documents (id serial PRIMARY KEY, content text);
     """)
     conn.commit()
     print("Tables created.")
 
-def insert_users(n=1000000, batch_size=10000):
+def insert_users(conn, n=1000000):
     print(f"Inserting {n} users...")
-    for i in range(0, n, batch_size):
-        batch = [
-            (
-                f"user_{i+j}",
-                json.dumps({
-                    "prefs": {
-                        "theme": "dark" if random.random() < 0.5 else "light",
-                        "lang": "en" if random.random() < 0.5 else "fr"
-                    }
-                })
-            )
-            for j in range(batch_size)
-        ]
-        execute_values(cur, "INSERT INTO users (name, profile) VALUES %s", batch)
-        conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("SET synchronous_commit = off;")
+        # Pick from PROFILE_JSONS instead of building a document per row; ~5% dark
+        # so the JSONB predicate is selective enough to favour an index.
+        cur.execute("""
+        INSERT INTO users (name, profile)
+        SELECT 'user_' || i,
+               (%s::jsonb[])[1 + (random() >= 0.05)::int * 2 + (random() >= 0.5)::int]
+        FROM generate_series(0, %s - 1) AS i
+        """, (list(PROFILE_JSONS), n))
+    conn.commit()
     print("Users inserted.")
 
-def insert_articles(n=1000000, batch_size=10000):
+def insert_articles(conn, n=1000000):
     tags_list = ['tech', 'news', 'postgres', 'gin', 'json', 'sql', 'backend', 'tutorial']
     print(f"Inserting {n} articles...")
-    for i in range(0, n, batch_size):
-        batch = [
-            (f"Article {i+j}", [random.choice(tags_list) for _ in range(5)])
-            for j in range(batch_size)
-        ]
-        execute_values(cur, "INSERT INTO articles (title, tags) VALUES %s", batch)
-        conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("SET synchronous_commit = off;")
+        # The tag subquery references i so it is evaluated per row instead of
+        # being hoisted into a single InitPlan shared by every article.
+        cur.execute("""
+        INSERT INTO articles (title, tags)
+        SELECT 'Article ' || i,
+               ARRAY(
+                   SELECT (%(tags)s::text[])[1 + floor(random() * %(n_tags)s)::int]
+                   FROM generate_series(1, 5 + 0 * i)
+               )
+        FROM generate_series(0, %(n)s - 1) AS i
+        """, {"tags": tags_list, "n_tags": len(tags_list), "n": n})
+    conn.commit()
     print("Articles inserted.")
 
-def insert_documents(n=1000000, batch_size=10000):
+def insert_documents(conn, n=1000000):
     print(f"Inserting {n} documents...")
-    for i in range(0, n, batch_size):
-        batch = [(f"PostgreSQL GIN indexes are awesome. {random.getrandbits(128)}",)
-                 for _ in range(batch_size)]
-        execute_values(cur, "INSERT INTO documents (content) VALUES %s", batch)
-        conn.commit()
+    with conn.cursor() as cur:
+        cur.execute("SET synchronous_commit = off;")
+        cur.execute("""
+        INSERT INTO documents (content)
+        SELECT 'PostgreSQL GIN indexes are awesome. ' || md5(random()::text)
+        FROM generate_series(1, %s)
+        """, (n,))
+    conn.commit()
     print("Documents inserted.")
 
+def insert_all(n=1000000):
+    # The tables are independent, so load each on its own connection.
+    def load(insert):
+        with connect() as load_conn:
+            insert(load_conn, n=n)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(load, insert) for insert in (insert_users, insert_articles, insert_documents)]
+        for future in futures:
+            future.result()
+
 # ---------------------------
 # Index handling
 # ---------------------------
 def create_btree_indexes():
     print("Creating B-tree indexes...")
-    cur.execute("CREATE INDEX idx_profile_btree ON users(profile);")
+    cur.execute("SET maintenance_work_mem = '2GB'; SET max_parallel_maintenance_workers = 4;")
+    # A B-tree on the whole jsonb document cannot serve @>, so index the scalar
+    # the B-tree variant of the JSONB query filters on instead.
+    cur.execute("CREATE INDEX idx_profile_btree ON users ((profile->'prefs'->>'theme'));")
     cur.execute("CREATE INDEX idx_tags_btree ON articles(tags);")
-    cur.execute("CREATE INDEX idx_content_btree ON documents(content);")
+    # Only a prefix: full documents bloat the B-tree, and the full-text query
+    # cannot use it either way (it is the baseline for the GIN run).
+    cur.execute("CREATE INDEX idx_content_btree ON documents ((left(content, 64)));")
     conn.commit()
     print("B-tree indexes created.")
 
 def create_gin_indexes():
     print("Creating GIN indexes...")
-    cur.execute("CREATE INDEX idx_profile_gin ON users USING GIN (profile jsonb_path_ops);")
+    cur.execute("SET maintenance_work_mem = '2GB'; SET max_parallel_maintenance_workers = 4;")
+    # jsonb_path_ops only supports @> (no ?/?|/?& key-existence operators), but
+    # hashes whole paths into single keys, so it is smaller and faster than the
+    # default jsonb_ops. Indexing just profile->'prefs' keeps it smaller still.
+    cur.execute("CREATE INDEX idx_profile_gin ON users USING GIN ((profile->'prefs') jsonb_path_ops);")
     cur.execute("CREATE INDEX idx_tags_gin ON articles USING GIN (tags);")
     cur.execute("CREATE INDEX idx_content_gin ON documents USING GIN (to_tsvector('english', content));")
     conn.commit()
@@ -98,45 +135,88 @@ def drop_indexes(index_type="btree"):
 # ---------------------------
 # Metrics collection
 # ---------------------------
-def get_index_size(index_name):
-    cur.execute(f"SELECT pg_total_relation_size('{index_name}')")
-    return cur.fetchone()[0] / (1024*1024)  # convert to MB
+def get_index_sizes(index_names):
+    cur.execute(
+        "SELECT n, pg_total_relation_size(n::regclass) / 1048576.0 "  # convert to MB
+        "FROM unnest(%s::text[]) AS n",
+        (index_names,)
+    )
+    return {name: float(size) for name, size in cur.fetchall()}
 
-def run_queries():
+def iter_plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+def run_queries(index_type="btree", runs=11):
+    # the first run is discarded, and quantiles() needs at least two samples
+    if runs < 3:
+        raise ValueError("runs must be at least 3")
+    if index_type == "btree":
+        jsonb_query = "SELECT * FROM users WHERE profile->'prefs'->>'theme' = 'dark';"
+    else:
+        jsonb_query = "SELECT * FROM users WHERE profile->'prefs' @> '{\"theme\": \"dark\"}';"
     queries = {
-        "JSONB Query": "SELECT * FROM users WHERE profile @> '{\"prefs\": {\"theme\": \"dark\"}}';",
+        "JSONB Query": jsonb_query,
         "Array Query": "SELECT * FROM articles WHERE 'postgres' = ANY(tags);",
         "Full-Text Query": "SELECT * FROM documents WHERE to_tsvector('english', content) @@ to_tsquery('english', 'GIN & indexes');"
     }
     results = {}
     for query_name, sql in queries.items():
-        cur.execute(f"EXPLAIN ANALYZE {sql}")
-        explain_output = cur.fetchall()
-        explain_text = "\n".join([row[0] for row in explain_output])
-        # extract execution time
-        for line in explain_text.split("\n"):
-            if "Execution Time" in line:
-                time_ms = float(line.strip().split(":")[1].replace(" ms",""))
-                results[query_name] = time_ms
+        times = []
+        for _ in range(runs):
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+            result = cur.fetchone()[0][0]
+            times.append(result["Execution Time"])
+        # the first run warms the buffer cache, so leave it out of the stats
+        times = times[1:]
+        plan = result["Plan"]
+        nodes = list(iter_plan_nodes(plan))
+        results[query_name] = {
+            "time": statistics.median(times),
+            "min": min(times),
+            "p95": statistics.quantiles(times, n=20, method="inclusive")[-1],
+            # buffer counts on a node already include its children
+            "shared_hit_blocks": plan["Shared Hit Blocks"],
+            "shared_read_blocks": plan["Shared Read Blocks"],
+            "buffers": plan["Shared Hit Blocks"] + plan["Shared Read Blocks"],
+            # rows discarded after re-checking heap tuples against the original
+            # condition; these counts are averaged per loop, so scale them back
+            # up by Actual Loops to get totals across parallel workers
+            "rows_removed_by_recheck": sum(
+                node.get("Rows Removed by Index Recheck", 0) * node["Actual Loops"] for node in nodes
+            ),
+            "rows_removed_by_filter": sum(
+                node.get("Rows Removed by Filter", 0) * node["Actual Loops"] for node in nodes
+            )
+        }
     return results
 
 # ---------------------------
 # Display results
 # ---------------------------
 def print_metrics(metrics):
-    table = PrettyTable()
-    table.field_names = ["Query", "B-tree (ms)", "B-tree size(MB)", "GIN (ms)", "GIN size(MB)", "Speedup (x)"]
+    row_format = "{:<18} {:>25} {:>16} {:>14} {:>25} {:>13} {:>12} {:>18} {:>12}"
+    print(row_format.format("Query", "B-tree min/med/p95 (ms)", "B-tree size(MB)", "B-tree buffers",
+                            "GIN min/med/p95 (ms)", "GIN size(MB)", "GIN buffers", "GIN recheck rows",
+                            "Speedup (x)"))
     
     queries = metrics.keys()
     for q in queries:
-        btree_time = metrics[q]["btree"]["time"]
-        btree_size = metrics[q]["btree"]["size"]
-        gin_time = metrics[q]["gin"]["time"]
-        gin_size = metrics[q]["gin"]["size"]
-        speedup = btree_time/gin_time if gin_time else 0
-        table.add_row([q, f"{btree_time:.2f}", f"{btree_size:.2f}", f"{gin_time:.2f}", f"{gin_size:.2f}", f"{speedup:.2f}"])
-    
-    print(table)
+        btree = metrics[q]["btree"]
+        gin = metrics[q]["gin"]
+        speedup = btree["time"]/gin["time"] if gin["time"] else 0
+        print(row_format.format(
+            q,
+            f"{btree['min']:.2f} / {btree['time']:.2f} / {btree['p95']:.2f}",
+            f"{btree['size']:.2f}",
+            btree["buffers"],
+            f"{gin['min']:.2f} / {gin['time']:.2f} / {gin['p95']:.2f}",
+            f"{gin['size']:.2f}",
+            gin["buffers"],
+            gin["rows_removed_by_recheck"],
+            f"{speedup:.2f}"
+        ))
 
 # ---------------------------
 # Main script
@@ -144,45 +224,47 @@ def print_metrics(metrics):
 if __name__ == "__main__":
     # 1. Prepare data
     recreate_tables()
-    insert_users(n=1000000, batch_size=10000)
-    insert_articles(n=1000000, batch_size=10000)
-    insert_documents(n=1000000, batch_size=10000)
+    insert_all(n=1000000)
 
     metrics = {}
     
     # 2. B-tree index metrics
     create_btree_indexes()
-    btree_metrics = run_queries()
-    metrics_btree_size = {
-        "JSONB Query": get_index_size("idx_profile_btree"),
-        "Array Query": get_index_size("idx_tags_btree"),
-        "Full-Text Query": get_index_size("idx_content_btree")
+    btree_metrics = run_queries("btree")
+    btree_indexes = {
+        "JSONB Query": "idx_profile_btree",
+        "Array Query": "idx_tags_btree",
+        "Full-Text Query": "idx_content_btree"
     }
+    sizes = get_index_sizes(list(btree_indexes.values()))
+    metrics_btree_size = {q: sizes[idx] for q, idx in btree_indexes.items()}
     drop_indexes("btree")
     
     # 3. GIN index metrics
     create_gin_indexes()
-    gin_metrics = run_queries()
-    metrics_gin_size = {
-        "JSONB Query": get_index_size("idx_profile_gin"),
-        "Array Query": get_index_size("idx_tags_gin"),
-        "Full-Text Query": get_index_size("idx_content_gin")
+    gin_metrics = run_queries("gin")
+    gin_indexes = {
+        "JSONB Query": "idx_profile_gin",
+        "Array Query": "idx_tags_gin",
+        "Full-Text Query": "idx_content_gin"
     }
+    sizes = get_index_sizes(list(gin_indexes.values()))
+    metrics_gin_size = {q: sizes[idx] for q, idx in gin_indexes.items()}
     drop_indexes("gin")
     
     # 4. Map metrics together
     for q in btree_metrics.keys():
         metrics[q] = {
-            "btree": {"time": btree_metrics[q], "size": metrics_btree_size[q]},
-            "gin": {"time": gin_metrics[q], "size": metrics_gin_size[q]}
+            "btree": {**btree_metrics[q], "size": metrics_btree_size[q]},
+            "gin": {**gin_metrics[q], "size": metrics_gin_size[q]}
         }
 
     # 5. Display and plot
     print_metrics(metrics)
     
     # Optional: save metrics to JSON
-    with open("metrics.json", "w") as f:
-        json.dump(metrics, f, indent=4)
+    with open("metrics.json", "wb") as f:
+        f.write(orjson.dumps(metrics, option=orjson.OPT_INDENT_2))
 
     cur.close()
     conn.close()
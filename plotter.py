@@ -1,4 +1,6 @@
 import json
+import matplotlib
+matplotlib.use("Agg")  # only writes a PNG, so skip loading a GUI backend
 import matplotlib.pyplot as plt
 
 def plot_metrics(metrics_file="metrics.json"):
@@ -39,8 +41,8 @@ def plot_metrics(metrics_file="metrics.json"):
     
     plt.tight_layout()
     plt.savefig("index_comparison_from_json.png")
+    plt.close(fig)
     print("Chart saved as 'index_comparison_from_json.png'")
-    plt.show()
 
 if __name__ == "__main__":
     plot_metrics()